@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""M3U解析、去重、关键词分类等纯计算逻辑，带完整类型注解以便用 mypyc 编译"""
+
+import re
+from typing import Any, Dict, FrozenSet, Iterable, List, Set
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+Channel = Dict[str, str]
+
+GROUP_TITLE_RE = re.compile(r'group-title="([^"]+)"')
+STREAM_PREFIXES = ('http://', 'https://', 'rtsp://', 'rtmp://')
+
+# 签名/时效类参数每次生成都不同，不影响指向哪个频道，去重时忽略
+VOLATILE_QUERY_KEYS = frozenset({
+    'token', 'tok', 'sign', 'signature', 'sig', 'expires', 'expire', 'e', 't', 'ts',
+    'timestamp', 'auth', 'auth_key', 'wssecret', 'wstime', 'txsecret', 'txtime', 'nonce'
+})
+
+def _trie_branches(node: Dict[str, Any]) -> str:
+    branches = [re.escape(char) + _trie_branches(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if '' in node:
+        return f'(?:{body})?'
+    return body
+
+def trie_pattern(keywords: Iterable[str]) -> str:
+    """把关键词列表编译成基于前缀树的正则表达式"""
+    trie: Dict[str, Any] = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword.casefold():
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return _trie_branches(trie)
+
+class KeywordMatcher:
+    """多分类关键词匹配，一次扫描返回名称命中的全部分类（输入需已 casefold）
+
+    以 ^ 开头的关键词（如 '^now'）只在名称开头作为独立词命中，避免 'News Now' 之类的误判。
+    """
+
+    def __init__(self, groups: Dict[str, List[str]]) -> None:
+        lookup: Dict[str, Set[str]] = {}
+        prefix_lookup: Dict[str, Set[str]] = {}
+        for group, keywords in groups.items():
+            for keyword in keywords:
+                if keyword.startswith('^'):
+                    prefix_lookup.setdefault(keyword[1:].casefold(), set()).add(group)
+                else:
+                    lookup.setdefault(keyword.casefold(), set()).add(group)
+
+        # 每个位置只取最长命中，所以长关键词要带上它包含的短关键词的分类
+        self._lookup: Dict[str, FrozenSet[str]] = {
+            keyword: frozenset().union(*(g for other, g in lookup.items() if other in keyword))
+            for keyword in lookup
+        }
+        self._regex = re.compile(f'(?=({trie_pattern(lookup)}))')
+
+        self._prefix_lookup: Dict[str, FrozenSet[str]] = {
+            keyword: frozenset(g) for keyword, g in prefix_lookup.items()
+        }
+        self._prefix_regex = re.compile(f'({trie_pattern(prefix_lookup)})(?![a-z0-9])') if prefix_lookup else None
+
+    def groups(self, text: str) -> Set[str]:
+        matched: Set[str] = set()
+        for match in self._regex.finditer(text):
+            matched |= self._lookup[match.group(1)]
+        if self._prefix_regex is not None:
+            prefix_match = self._prefix_regex.match(text)
+            if prefix_match:
+                matched |= self._prefix_lookup[prefix_match.group(1)]
+        return matched
+
+def is_blocked_group(group_title: str, blocked_groups: List[str]) -> bool:
+    if not group_title:
+        return False
+    group_lower = group_title.lower()
+    return any(keyword in group_lower for keyword in blocked_groups)
+
+def parse_m3u(lines: Iterable[str], source_url: str, blocked_groups: List[str]) -> List[Channel]:
+    channels: List[Channel] = []
+    current_channel: Channel = {}
+
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith('#EXTINF'):
+            current_channel = {'raw_extinf': line}
+            _, comma, name = line.rpartition(',')
+            group_match = GROUP_TITLE_RE.search(line)
+
+            current_channel['name'] = name.strip() if comma else f"Unknown_{i}"
+            current_channel['_name_lower'] = current_channel['name'].casefold()
+            current_channel['group'] = group_match.group(1).strip() if group_match else ''
+
+            if is_blocked_group(current_channel['group'], blocked_groups):
+                current_channel = {}
+                continue
+
+        elif line.startswith(STREAM_PREFIXES):
+            if current_channel:
+                current_channel['url'] = line
+                current_channel['source'] = source_url
+                channels.append(current_channel)
+                current_channel = {}
+
+    return channels
+
+def normalize_url(url: str) -> str:
+    """去重用的URL键：去掉片段、末尾斜杠和签名类参数，其余参数排序"""
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in VOLATILE_QUERY_KEYS
+    )
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path.rstrip('/'), urlencode(query), ''))
+
+def dedupe_channels(channels: List[Channel]) -> List[Channel]:
+    """按规范化URL去重，保留第一次出现的完整URL"""
+    seen_urls: Set[str] = set()
+    unique_channels: List[Channel] = []
+    for channel in channels:
+        key = normalize_url(channel['url'])
+        if key not in seen_urls:
+            seen_urls.add(key)
+            unique_channels.append(channel)
+    return unique_channels
+
+def interleave_by_host(channels: List[Channel]) -> List[Channel]:
+    """按主机轮转排列频道，避免同一主机的频道连续占满验证线程"""
+    by_host: Dict[str, List[Channel]] = {}
+    for channel in channels:
+        try:
+            host = urlsplit(channel['url']).netloc
+        except ValueError:
+            host = ''
+        by_host.setdefault(host, []).append(channel)
+
+    queues = list(by_host.values())
+    interleaved: List[Channel] = []
+    depth = 0
+    while queues:
+        queues = [queue for queue in queues if len(queue) > depth]
+        interleaved.extend(queue[depth] for queue in queues)
+        depth += 1
+    return interleaved
+
+def filter_quality_channels(channels: List[Channel], matcher: KeywordMatcher) -> List[Channel]:
+    quality_channels: List[Channel] = []
+
+    for channel in channels:
+        matched = matcher.groups(channel['_name_lower'])
+
+        if 'bad' in matched:
+            continue
+
+        if 'good' in matched:
+            quality_channels.append(channel)
+            continue
+
+        quality_channels.append(channel)
+
+    return quality_channels
+
+def categorize_channel(name_lower: str, matcher: KeywordMatcher, priority: List[str]) -> str:
+    matched = matcher.groups(name_lower)
+    for category in priority:
+        if category in matched:
+            return category
+
+    return 'other'
@@ -2,27 +2,120 @@
 # -*- coding: utf-8 -*-
 
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import re
-from datetime import datetime
+from datetime import datetime, timezone
 import time
 import os
+import socket
+import functools
+import itertools
+import threading
 import concurrent.futures
+from pathlib import Path
 from urllib.parse import urlparse
 
+import iptv_core
+from iptv_core import KeywordMatcher
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dump_json(path, data, indent=True):
+    """写出JSON文件，装了 orjson 时用它的C实现编码"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=option))
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2 if indent else None)
+
+def load_json(path):
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# 输出文件较大，用 1MB 缓冲减少写入系统调用
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+# 跨运行的探测缓存：有效结果保留到第二天的定时任务，失效结果只保留半小时
+PROBE_CACHE_PATH = 'logs/probe_cache.json'
+PROBE_CACHE_OK_TTL = 25 * 3600
+PROBE_CACHE_DEAD_TTL = 30 * 60
+PROBE_CACHE_MAX_ENTRIES = 50000
+
+README_SECTION_RE = re.compile(r'## 📡 直播源地址.*?---', re.DOTALL)
+
+# 这些平台的直播链接无法用HEAD验证，直接放行
+SKIP_HOSTS = frozenset({'youtube.com', 'www.youtube.com', 'youtu.be', 'twitch.tv', 'www.twitch.tv'})
+SKIP_HOST_SUFFIXES = ('.youtube.com', '.twitch.tv')
+
+DEFAULT_PORTS = {'rtsp': 554, 'rtmp': 1935}
+
+@functools.lru_cache(maxsize=4096)
+def resolve_address(host, port):
+    """解析主机地址，同一主机在一次运行内只查询一次DNS"""
+    *_, sockaddr = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+    return sockaddr[:2]
+
 class IPTVUpdater:
     def __init__(self):
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'okhttp/1.3.14'
         })
+        # 验证线程共享同一个Session，按主机复用连接
+        adapter = HTTPAdapter(pool_connections=64, pool_maxsize=128, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         self.all_channels = []
         self.log_messages = []
         self.repository_owner = os.environ.get('GITHUB_REPOSITORY_OWNER', 'ngdikman')
         self.repository_name = os.environ.get('GITHUB_REPOSITORY', 'DailyIPTV').split('/')[-1]
 
+        self.set_generated_time()
+
         self.blocked_groups = ['直播中国', '冰茶公告', '纪录频道', '春晚频道']
-        
+
+        self._quality_matcher = KeywordMatcher({
+            'bad': ['test', 'example', 'demo', '无效', '测试', '春晚'],
+            'good': [
+                'cctv', '央视', '卫视', '湖南', '浙江', '江苏', '北京', '上海', '广东',
+                'viutv', '无线新闻', '^HOY', '^NOW', '香港', '凤凰', '翡翠', '明珠', 'tvb', '^RTHK'
+            ]
+        })
+        self.category_priority = ['cctv', 'satellite', 'local', 'hongkong']
+        self._category_matcher = KeywordMatcher({
+            'cctv': ['cctv', '央视', '中央'],
+            'satellite': ['卫视', '凤凰', '湖南', '浙江', '江苏', '北京'],
+            'local': ['都市', '新闻', '民生', '公共', '教育', '少儿', '体育'],
+            'hongkong': ['tvb', 'viutv', '无线新闻', '^HOY', '^NOW', '凤凰', '翡翠', '明珠', '^RTHK']
+        })
+
+        # 每个主机同时最多 8 个探测，避免高并发压垮单个CDN
+        self.per_host_limit = 8
+        self._host_semaphores = {}
+        self._host_semaphores_lock = threading.Lock()
+
+        # 探测结果缓存（url -> (有效, 说明, 探测时间)），以及连续连接失败的主机黑名单
+        # 任意一次成功探测都会清零该主机的失败计数
+        self.dead_host_threshold = 3
+        self._probe_cache = {}
+        self._host_failures = {}
+        self._dead_hosts = set()
+        self._probe_lock = threading.Lock()
+        
+    def set_generated_time(self):
+        # 本次运行的所有输出共用同一个生成时间
+        self.generated_at_utc = datetime.now(timezone.utc)
+        self.generated_at_local = self.generated_at_utc.astimezone().replace(tzinfo=None)
+
     def log(self, message):
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         log_message = f"[{timestamp}] {message}"
@@ -48,91 +141,193 @@ class IPTVUpdater:
     def fetch_source(self, url, timeout=15):
         try:
             self.log(f"正在获取: {url}")
-            response = self.session.get(url, timeout=timeout)
+            response = self.session.get(url, timeout=timeout, stream=True)
             response.encoding = 'utf-8'
             if response.status_code == 200:
-                return response.text
+                return response
             else:
                 self.log(f"获取失败，状态码: {response.status_code}")
+                response.close()
                 return None
         except Exception as e:
             self.log(f"获取异常: {e}")
             return None
+
+    def load_source(self, url):
+        response = self.fetch_source(url)
+        if response is None:
+            return None
+        try:
+            with response:
+                lines = response.iter_lines(chunk_size=65536, decode_unicode=True)
+                # 空响应体和原来一样算获取失败，这样才会回退到备用源
+                first_line = next(lines, None)
+                if first_line is None:
+                    self.log("获取失败，内容为空")
+                    return None
+                return self.parse_m3u(itertools.chain([first_line], lines), url)
+        except Exception as e:
+            self.log(f"读取异常: {e}")
+            return None
     
-    def is_blocked_group(self, group_title):
-        if not group_title:
-            return False
-        group_lower = group_title.lower()
-        return any(keyword in group_lower for keyword in self.blocked_groups)
+    def fetch_sources(self, urls, max_workers=8):
+        if not urls:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as executor:
+            return list(zip(urls, executor.map(self.load_source, urls)))
+    
+    def parse_m3u(self, lines, source_url):
+        channels = iptv_core.parse_m3u(lines, source_url, self.blocked_groups)
+        self.log(f"从该源解析出 {len(channels)} 个频道")
+        return channels
+    
+    def host_semaphore(self, host):
+        with self._host_semaphores_lock:
+            semaphore = self._host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host_limit)
+                self._host_semaphores[host] = semaphore
+            return semaphore
 
-    def parse_m3u(self, content, source_url):
-        channels = []
-        current_channel = {}
-        lines = content.splitlines()
-        
-        for i, line in enumerate(lines):
-            line = line.strip()
-            if not line:
-                continue
-                
-            if line.startswith('#EXTINF'):
-                current_channel = {'raw_extinf': line}
-                name_match = re.search(r',(?P<name>.*)$', line)
-                group_match = re.search(r'group-title="([^"]+)"', line)
+    def mark_host_failure(self, host):
+        with self._probe_lock:
+            failures = self._host_failures.get(host, 0) + 1
+            self._host_failures[host] = failures
+            if failures >= self.dead_host_threshold:
+                self._dead_hosts.add(host)
 
-                current_channel['name'] = name_match.group('name').strip() if name_match else f"Unknown_{i}"
-                current_channel['group'] = group_match.group(1).strip() if group_match else ''
+    def mark_host_success(self, host):
+        with self._probe_lock:
+            self._host_failures.pop(host, None)
 
-                if self.is_blocked_group(current_channel['group']):
-                    current_channel = {}
+    def is_probe_fresh(self, entry, now):
+        is_valid, _, checked_at = entry
+        ttl = PROBE_CACHE_OK_TTL if is_valid else PROBE_CACHE_DEAD_TTL
+        return now - checked_at < ttl
+
+    def load_probe_cache(self):
+        # 缓存文件随仓库提交，内容异常时忽略即可，不能影响本次更新
+        try:
+            entries = load_json(PROBE_CACHE_PATH)
+            now = time.time()
+            for url, entry in entries.items():
+                try:
+                    is_valid, message, checked_at = entry
+                    entry = (bool(is_valid), str(message), float(checked_at))
+                except (TypeError, ValueError):
                     continue
-                    
-            elif line.startswith(('http://', 'https://', 'rtsp://', 'rtmp://')):
-                if current_channel:
-                    current_channel['url'] = line
-                    current_channel['source'] = source_url
-                    channels.append(current_channel)
-                    current_channel = {}
-        
-        self.log(f"从该源解析出 {len(channels)} 个频道")
-        return channels
-    
+                if self.is_probe_fresh(entry, now):
+                    self._probe_cache[url] = entry
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            self._probe_cache.clear()
+            self.log(f"加载探测缓存失败: {e}")
+            return
+        self.log(f"加载探测缓存: {len(self._probe_cache)} 条")
+
+    def save_probe_cache(self):
+        now = time.time()
+        fresh = [(url, entry) for url, entry in self._probe_cache.items() if self.is_probe_fresh(entry, now)]
+        # 超出上限时只保留最近探测的条目
+        if len(fresh) > PROBE_CACHE_MAX_ENTRIES:
+            fresh.sort(key=lambda item: item[1][2], reverse=True)
+            fresh = fresh[:PROBE_CACHE_MAX_ENTRIES]
+        try:
+            dump_json(PROBE_CACHE_PATH, dict(fresh), indent=False)
+        except Exception as e:
+            self.log(f"保存探测缓存失败: {e}")
+
     def is_url_accessible(self, channel, timeout=3):
         url = channel['url']
+        with self._probe_lock:
+            cached = self._probe_cache.get(url)
+        if cached is not None and self.is_probe_fresh(cached, time.time()):
+            return cached[:2]
+
+        is_valid, message = self.probe_url(url, timeout)
+        with self._probe_lock:
+            self._probe_cache[url] = (is_valid, message, time.time())
+        return is_valid, message
+
+    def probe_url(self, url, timeout=3):
+        host = None
         try:
             parsed_url = urlparse(url)
             if not parsed_url.scheme or not parsed_url.netloc:
                 return False, "无效的URL格式"
             
-            if any(domain in url for domain in ['youtube.com', 'youtu.be', 'twitch.tv']):
+            hostname = parsed_url.hostname or ''
+            if hostname in SKIP_HOSTS or hostname.endswith(SKIP_HOST_SUFFIXES):
                 return True, "流媒体链接（跳过验证）"
+
+            host = parsed_url.netloc
+            if host in self._dead_hosts:
+                return False, "主机已屏蔽"
+            
+            # requests 不支持 rtsp/rtmp，这两种协议只做一次TCP连接判断可达
+            if parsed_url.scheme in DEFAULT_PORTS:
+                port = parsed_url.port or DEFAULT_PORTS[parsed_url.scheme]
+                address = resolve_address(parsed_url.hostname, port)
+                with self.host_semaphore(host):
+                    socket.create_connection(address, timeout=timeout).close()
+                self.mark_host_success(host)
+                return True, "端口可连接"
             
-            response = requests.head(url, timeout=timeout, allow_redirects=True, headers={
-                'User-Agent': 'Mozilla/5.0'
-            })
+            with self.host_semaphore(host):
+                response = self.session.head(url, timeout=timeout, allow_redirects=True)
+            # 服务器有响应就说明主机可达，不论状态码
+            self.mark_host_success(host)
             
-            if response.status_code in [200, 302, 301]:
+            if 200 <= response.status_code < 400:
                 return True, f"状态码: {response.status_code}"
             else:
                 return False, f"状态码: {response.status_code}"
                 
+        except requests.exceptions.ConnectTimeout:
+            if host:
+                self.mark_host_failure(host)
+            return False, "连接超时"
         except requests.exceptions.Timeout:
+            # 读超时只说明这个URL慢，不计入主机失败
             return False, "连接超时"
         except requests.exceptions.ConnectionError:
+            if host:
+                self.mark_host_failure(host)
+            return False, "连接错误"
+        except requests.exceptions.RequestException as e:
+            # RequestException 继承自 OSError，要在套接字异常之前单独处理，且不计入主机失败
+            return False, f"异常: {str(e)}"
+        except socket.gaierror:
+            if host:
+                self.mark_host_failure(host)
+            return False, "DNS解析失败"
+        except socket.timeout:
+            if host:
+                self.mark_host_failure(host)
+            return False, "连接超时"
+        except OSError:
+            if host:
+                self.mark_host_failure(host)
             return False, "连接错误"
         except Exception as e:
             return False, f"异常: {str(e)}"
     
-    def validate_channels_parallel(self, channels, max_workers=5):
+    def validate_channels_parallel(self, channels, max_workers=None):
         valid_channels = []
         validation_results = []
+
+        # 验证是纯网络等待，按频道数放大并发，上限与连接池大小一致
+        if max_workers is None:
+            max_workers = min(128, max(16, len(channels) // 4))
         
-        self.log(f"开始并行验证 {len(channels)} 个频道...")
+        self.log(f"开始并行验证 {len(channels)} 个频道 (并发 {max_workers})...")
         
+        # 源里同一主机的频道常常成片出现，轮转后单主机并发上限才不会让线程排队空等
         with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
             future_to_channel = {
                 executor.submit(self.is_url_accessible, channel): channel 
-                for channel in channels
+                for channel in iptv_core.interleave_by_host(channels)
             }
             
             for i, future in enumerate(concurrent.futures.as_completed(future_to_channel)):
@@ -160,69 +355,39 @@ class IPTVUpdater:
                     })
         
         try:
-            with open('logs/validation_details.json', 'w', encoding='utf-8') as f:
-                json.dump(validation_results, f, ensure_ascii=False, indent=2)
+            dump_json('logs/validation_details.json', validation_results)
         except:
             pass
         
         return valid_channels, validation_results
     
     def filter_quality_channels(self, channels):
-        quality_channels = []
-        
-        for channel in channels:
-            url = channel['url']
-            name = channel['name'].lower()
-            
-            if any(bad_name in name for bad_name in ['test', 'example', 'demo', '无效', '测试', '春晚']):
-                continue
-                
-            if any(good_keyword in name for good_keyword in [
-                'cctv', '央视', '卫视', '湖南', '浙江', '江苏', '北京', '上海', '广东', 
-                'viutv', '无线新闻', 'HOY', 'NOW', '香港', '凤凰', '翡翠', '明珠', 'tvb', 'RTHK'
-            ]):
-                quality_channels.append(channel)
-                continue
-                
-            quality_channels.append(channel)
-        
-        return quality_channels
+        return iptv_core.filter_quality_channels(channels, self._quality_matcher)
     
-    def categorize_channel(self, channel_name):
-        name_lower = channel_name.lower()
-        
-        cctv_keywords = ['cctv', '央视', '中央']
-        if any(keyword in name_lower for keyword in cctv_keywords):
-            return 'cctv'
-        
-        satellite_keywords = ['卫视', '凤凰', '湖南', '浙江', '江苏', '北京']
-        if any(keyword in name_lower for keyword in satellite_keywords):
-            return 'satellite'
-        
-        local_keywords = ['都市', '新闻', '民生', '公共', '教育', '少儿', '体育']
-        if any(keyword in name_lower for keyword in local_keywords):
-            return 'local'
-        
-        hongkong_keywords = ['tvb', 'viutv', '无线新闻', 'HOY', 'NOW', '凤凰', '翡翠', '明珠', 'RTHK']
-        if any(keyword in name_lower for keyword in hongkong_keywords):
-            return 'hongkong'
-        
-        return 'other'
+    def categorize_channel(self, name_lower):
+        return iptv_core.categorize_channel(name_lower, self._category_matcher, self.category_priority)
     
-    def generate_m3u_content(self, channels, title="直播源"):
-        header = f"""#EXTM3U
+    def m3u_header(self, channels, title):
+        return f"""#EXTM3U
 #EXTENC: UTF-8
-# Generated: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}
+# Generated: {self.generated_at_utc.strftime('%Y-%m-%d %H:%M:%S UTC')}
 # Title: {title}
 # Total Channels: {len(channels)}
 # For personal testing only.
 
 """
-        content = header
+
+    def m3u_lines(self, channels, title):
+        yield self.m3u_header(channels, title)
         for channel in channels:
-            content += f"{channel['raw_extinf']}\n{channel['url']}\n"
-        
-        return content
+            yield f"{channel['raw_extinf']}\n{channel['url']}\n"
+
+    def generate_m3u_content(self, channels, title="直播源"):
+        return ''.join(self.m3u_lines(channels, title))
+
+    def write_m3u_file(self, path, channels, title="直播源"):
+        with open(path, 'wb', buffering=OUTPUT_BUFFER_SIZE) as f:
+            f.writelines(line.encode('utf-8') for line in self.m3u_lines(channels, title))
     
     def update_readme(self, stats):
         try:
@@ -230,7 +395,7 @@ class IPTVUpdater:
                 readme_content = f.read()
             
             base_url = f"https://raw.githubusercontent.com/{self.repository_owner}/{self.repository_name}/main/outputs"
-            update_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            update_time = self.generated_at_local.strftime('%Y-%m-%d %H:%M:%S')
             
             live_sources_section = f"""
 ## 📡 直播源地址
@@ -258,8 +423,7 @@ class IPTVUpdater:
 """
             
             if '## 📡 直播源地址' in readme_content:
-                pattern = r'## 📡 直播源地址.*?---'
-                updated_readme = re.sub(pattern, live_sources_section.strip(), readme_content, flags=re.DOTALL)
+                updated_readme = README_SECTION_RE.sub(live_sources_section.strip(), readme_content)
             else:
                 updated_readme = readme_content.replace('# DailyIPTV 📺', f'# DailyIPTV 📺\n{live_sources_section}')
             
@@ -275,43 +439,33 @@ class IPTVUpdater:
 
     def run(self):
         start_time = time.time()
+        self.set_generated_time()
         self.log("开始更新IPTV直播源")
+        os.makedirs('outputs', exist_ok=True)
+        os.makedirs('logs', exist_ok=True)
         
         self.sources_config = self.load_sources()
+        self.load_probe_cache()
         
         all_channels = []
         successful_sources = 0
         
-        for source_url in self.sources_config['sources']:
-            content = self.fetch_source(source_url)
-            if content:
-                channels = self.parse_m3u(content, source_url)
+        for source_url, channels in self.fetch_sources(self.sources_config['sources']):
+            if channels is not None:
                 all_channels.extend(channels)
                 successful_sources += 1
-                time.sleep(1)
         
         if successful_sources == 0 and self.sources_config['backup_sources']:
             self.log("尝试备用源...")
-            for backup_url in self.sources_config['backup_sources']:
-                content = self.fetch_source(backup_url)
-                if content:
-                    channels = self.parse_m3u(content, backup_url)
+            for backup_url, channels in self.fetch_sources(self.sources_config['backup_sources']):
+                if channels is not None:
                     all_channels.extend(channels)
                     successful_sources += 1
-                    time.sleep(1)
         
-        unique_channels = {}
-        for channel in all_channels:
-            url = channel['url']
-            if url not in unique_channels:
-                unique_channels[url] = channel
-        
-        unique_channels_list = list(unique_channels.values())
+        unique_channels_list = iptv_core.dedupe_channels(all_channels)
         self.log(f"去重后频道: {len(unique_channels_list)}")
         
-        raw_content = self.generate_m3u_content(unique_channels_list, "原始直播源")
-        with open('outputs/full_raw.m3u', 'w', encoding='utf-8') as f:
-            f.write(raw_content)
+        self.write_m3u_file('outputs/full_raw.m3u', unique_channels_list, "原始直播源")
         
         quality_channels = self.filter_quality_channels(unique_channels_list)
         self.log(f"质量过滤后: {len(quality_channels)}")
@@ -328,28 +482,23 @@ class IPTVUpdater:
         
         categorized_channels = {'cctv': [], 'satellite': [], 'local': [], 'hongkong': [], 'other': []}
         for channel in valid_channels:
-            category = self.categorize_channel(channel['name'])
+            category = self.categorize_channel(channel['_name_lower'])
             categorized_channels[category].append(channel)
         
-        validated_content = self.generate_m3u_content(valid_channels, "已验证直播源")
-        with open('outputs/full_validated.m3u', 'w', encoding='utf-8') as f:
-            f.write(validated_content)
+        self.write_m3u_file('outputs/full_validated.m3u', valid_channels, "已验证直播源")
         
         for category, channels in categorized_channels.items():
             if channels:
-                category_content = self.generate_m3u_content(channels, f"{category}频道")
-                with open(f'outputs/{category}.m3u', 'w', encoding='utf-8') as f:
-                    f.write(category_content)
+                self.write_m3u_file(f'outputs/{category}.m3u', channels, f"{category}频道")
         
-        with open('logs/latest_update.log', 'w', encoding='utf-8') as f:
-            f.write('\n'.join(self.log_messages))
+        Path('logs/latest_update.log').write_bytes('\n'.join(self.log_messages).encode('utf-8'))
         
         end_time = time.time()
         duration = end_time - start_time
         validity_ratio = len(valid_channels) / len(quality_channels) if quality_channels else 0
         
         stats = {
-            'update_time': datetime.now().isoformat(),
+            'update_time': self.generated_at_local.isoformat(),
             'duration_seconds': round(duration, 2),
             'validation_seconds': round(validation_time, 2),
             'sources_attempted': len(self.sources_config['sources']) + len(self.sources_config['backup_sources']),
@@ -361,10 +510,14 @@ class IPTVUpdater:
             'categories': {k: len(v) for k, v in categorized_channels.items()}
         }
         
-        with open('outputs/stats.json', 'w', encoding='utf-8') as f:
-            json.dump(stats, f, ensure_ascii=False, indent=2)
+        dump_json('outputs/stats.json', stats)
         
         self.update_readme(stats)
+
+        self.save_probe_cache()
+        self._probe_cache.clear()
+        self._host_failures.clear()
+        self._dead_hosts.clear()
         
         self.log(f"更新完成！耗时: {duration:.1f}秒")
         self.log(f"有效频道: {len(valid_channels)}/{len(quality_channels)} ({validity_ratio:.1%})")